@@ -1,11 +1,32 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
 import struct
 
+# fixed-size part of the header: magic, header size, content size, width, height
+_HEADER = struct.Struct("<4sQQQQ")
+# a single pixel: red, green, blue
+_PIXEL = struct.Struct("BBB")
+
 
 class CIFF:
     """
     Holds data of a CIFF image
     """
 
+    __slots__ = (
+        "magic",
+        "header_size",
+        "content_size",
+        "width",
+        "height",
+        "caption",
+        "tags",
+        "_pixels",
+        "_pixel_source",
+        "is_valid",
+        "error_message"
+    )
+
     def __init__(
             self,
             magic_chars="CIFF",
@@ -15,7 +36,7 @@ class CIFF:
             height_long=0,
             caption_string="",
             tags_list=None,
-            pixels_list=None
+            pixel_bytes=None
     ):
         """
         Constructor for CIFF images
@@ -27,159 +48,102 @@ class CIFF:
         :param height_long: height of the image (8-byte-long int)
         :param caption_string: caption of the image (string)
         :param tags_list: list of tags in the image
-        :param pixels_list: list of pixels to display
-        """
-        self._magic = magic_chars
-        self._header_size = header_size_long
-        self._content_size = content_size_long
-        self._width = width_long
-        self._height = height_long
-        self._caption = caption_string
+        :param pixel_bytes: RGB bytes of the pixels to display (bytes-like)
+        """
+        self.magic = magic_chars
+        self.header_size = header_size_long
+        self.content_size = content_size_long
+        self.width = width_long
+        self.height = height_long
+        self.caption = caption_string
         if tags_list is None:
-            self._tags = []
+            self.tags = []
         else:
-            self._tags = tags_list
-        if pixels_list is None:
-            self._pixels = []
-        else:
-            self._pixels = pixels_list
-        self._is_valid = True
-        self._error_message = ""
+            self.tags = tags_list
+        self._pixels = pixel_bytes
+        # (file path, header size) to load the pixels from on first access
+        self._pixel_source = None
+        # whether the image conforms with the specification or not,
+        # and the reason in case it does not
+        self.is_valid = True
+        self.error_message = ""
 
     #
     # Properties
     #
 
     @property
-    def is_valid(self):
-        """
-        A flag indicating whether the the CIFF image conforms
-        with the specification or not
-
-        :return: boolean
-        """
-        return self._is_valid
-
-    @is_valid.setter
-    def is_valid(self, value):
-        self._is_valid = value
-
-    @property
-    def error_message(self):
-        """
-        An error message in case the image is not valid
-
-        :return: str
-        """
-        return self._error_message
-    
-    @error_message.setter
-    def error_message(self, value):
-        self._error_message = value
-
-    @property
-    def magic(self):
-        """
-        The parsed magic characters
-
-        :return: str
-        """
-        return self._magic
-
-    @magic.setter
-    def magic(self, value):
-        self._magic = value
-
-    @property
-    def header_size(self):
-        """
-        The parsed header size
-
-        :return: int
-        """
-        return self._header_size
-
-    @header_size.setter
-    def header_size(self, value):
-        self._header_size = value
-
-    @property
-    def content_size(self):
-        """
-        The parsed content size
-
-        :return: int
-        """
-        return self._content_size
-
-    @content_size.setter
-    def content_size(self, value):
-        self._content_size = value
-
-    @property
-    def width(self):
-        """
-        The parsed width of the image
-
-        :return: int
-        """
-        return self._width
-
-    @width.setter
-    def width(self, value):
-        self._width = value
-
-    @property
-    def height(self):
-        """
-        The parsed height of the image
-
-        :return: int
-        """
-        return self._height
-
-    @height.setter
-    def height(self, value):
-        self._height = value
-
-    @property
-    def caption(self):
+    def pixels(self):
         """
-        The parsed image caption
+        The parsed pixels, a view of the RGB bytes of the file with
+        shape (height, width, 3); flat for images without pixels
+
+        The pixels of a parsed file are only read from disk
+        the first time they are accessed; if that fails, the image
+        is marked invalid and None is returned
+
+        :return: memoryview or None
+        """
+        pixel_source = self._pixel_source
+        if self._pixels is None and pixel_source is not None:
+            # the source is only cleared once the outcome is recorded, so a
+            # concurrent access never sees a valid image without pixels;
+            # at worst both accesses load the same pixels
+            try:
+                self._pixels = self._load_pixels(*pixel_source)
+            except Exception as e:
+                self.is_valid = False
+                self.error_message = str(e)
+            self._pixel_source = None
+        return self._pixels
 
-        :return: str
-        """
-        return self._caption
+    @pixels.setter
+    def pixels(self, value):
+        self._pixels = value
+        self._pixel_source = None
 
-    @caption.setter
-    def caption(self, value):
-        self._caption = value
+    #
+    # Methods
+    #
 
-    @property
-    def tags(self):
+    def pixels_to_tuples(self):
         """
-        The parsed list of tags
+        Converts the parsed pixels into a list of (r, g, b) tuples,
+        a new list is built from the pixel bytes on every call
 
-        :return: list of strings
+        :return: list of tuples
         """
-        return self._tags
-
-    @tags.setter
-    def tags(self, value):
-        self._tags = value
+        pixels = self.pixels
+        if pixels is None:
+            return []
+        return list(_PIXEL.iter_unpack(pixels))
 
-    @property
-    def pixels(self):
-        """
-        The parsed pixels
-
-        :return: list
-        """
-        return self._pixels
+    #
+    # Helpers
+    #
 
-    @pixels.setter
-    def pixels(self, value):
-        self._pixels = value
+    def _load_pixels(self, file_path, header_size):
+        """
+        Reads the pixels of a parsed CIFF file from disk
+
+        :param file_path: path to the parsed file (string)
+        :param header_size: size of the header of the parsed file in bytes
+        :return: memoryview of the pixels
+        """
+        # memoryview cannot take a shape containing zeros
+        if self.content_size == 0:
+            return memoryview(b"")
+        # the pixels are copied out of the file rather than mapped, so that
+        # later changes to the file cannot affect the validated data
+        with open(file_path, "rb") as ciff_file:
+            # the file may have changed since it was parsed
+            if os.fstat(ciff_file.fileno()).st_size != header_size + self.content_size:
+                raise Exception("Invalid image: content")
+            ciff_file.seek(header_size)
+            pixel_bytes = ciff_file.read(self.content_size)
+        if len(pixel_bytes) != self.content_size:
+            raise Exception("Invalid image: content")
+        return memoryview(pixel_bytes).cast('B', shape=[self.height, self.width, 3])
 
     #
     # Static methods
@@ -196,134 +160,95 @@ class CIFF:
         :return: the parsed CIFF object
         """
         new_ciff = CIFF()
-        bytes_read = 0
         # the following code can throw Exceptions at multiple lines
         try:
+            # only the header is read here, the pixels are left on disk
+            # until they are first accessed
             with open(file_path, "rb") as ciff_file:
-                # read the magic bytes
-                magic = ciff_file.read(4)
-                # read may not return the requested number of bytes
-                if len(magic) != 4:
+                file_size = os.fstat(ciff_file.fileno()).st_size
+
+                # read the magic bytes together with the rest of the
+                # fixed-size header
+                fixed_header = ciff_file.read(_HEADER.size)
+                if len(fixed_header) < 4:
                     raise Exception("Couldn't read 4 magic bytes")
-                bytes_read += 4
                 # decode the bytes as 4 characters
-                new_ciff.magic = magic.decode('ascii')
-                if new_ciff.magic != "CIFF":
+                magic = fixed_header[:4].decode('ascii')
+                new_ciff.magic = magic
+                if magic != "CIFF":
                     new_ciff.is_valid = False
                     raise Exception("Error parsing magic bytes")
 
-                # read the header size
-                h_size = ciff_file.read(8)
-                if len(h_size) != 8:
-                    raise Exception("Invalid image format: header size")
-                bytes_read += 8
-                # interpret the bytes as an 8-byte-long integer
-                # unpack returns a list
-                # HINT: check the "q" format specifier!
-                # HINT: Does it fit our purposes?
-                new_ciff.header_size = struct.unpack("Q", h_size)[0]
+                # the rest of the fixed-size header: header size, content size,
+                # width and height, each an unsigned 8-byte-long little endian integer
+                if len(fixed_header) < _HEADER.size:
+                    raise Exception("Invalid image format: header")
+                _, header_size, content_size, width, height = _HEADER.unpack(fixed_header)
+
+                new_ciff.header_size = header_size
                 # the header size must be in [38, 2^64 - 1]
-                if new_ciff.header_size < 38:
+                if header_size < 38:
                     raise Exception("Invalid image format: header size")
-                
-
-                # read the content size
-                c_size = ciff_file.read(8)
-                if len(c_size) != 8:
-                    raise Exception("Invalid image format: content size")
-                bytes_read += 8
-                # interpret the bytes as an 8-byte-long integer
-                # HINT: check out the "q" format specifier!
-                # HINT: Does it fit our purposes?
-                new_ciff.content_size = struct.unpack("Q", c_size)[0]
-
-                # read the width
-                width = ciff_file.read(8)
-                if len(width) != 8:
-                    raise Exception("Invalid image format: width")
-                bytes_read += 8
-                # interpret the bytes as an 8-byte-long integer
-                # HINT: check out the "q" format specifier!
-                # HINT: Does it fit our purposes?
-                new_ciff.width = struct.unpack("Q", width)[0]
-                # the width must be in [0, 2^64 - 1]
-
-                # read the height
-                height = ciff_file.read(8)
-                if len(height) != 8:
-                    raise Exception("Invalid image format: height")
-                bytes_read += 8
-                # interpret the bytes as an 8-byte-long integer
-                # HINT: check out the "q" format specifier!
-                # HINT: Does it fit our purposes?
-                new_ciff.height = struct.unpack("Q", height)[0]
-                # the height must be in [0, 2^64 - 1]
-                if new_ciff.content_size != new_ciff.width * new_ciff.height * 3:
+                new_ciff.content_size = content_size
+                # the width and height must be in [0, 2^64 - 1]
+                new_ciff.width = width
+                new_ciff.height = height
+                if content_size != width * height * 3:
                     raise Exception("Invalid image format: content size not equal to width*height*3")
 
-                # read the name of the image character by character
-                caption = ""
-                c = ciff_file.read(1)
-                if len(c) != 1:
-                    raise Exception("Invalid image format: caption format")
-                bytes_read += 1
-                char = c.decode('ascii')
-                # read until the first '\n' (caption cannot contain '\n')
-                while char != '\n':
-                    # append read character to caption
-                    caption += char
-                    # read next character
-                    c = ciff_file.read(1)
-                    if len(c) != 1:
-                        raise Exception("Invalid image: caption")
-                    bytes_read += 1
-                    char = c.decode('ascii')
-                new_ciff.caption = caption
-
-                # read all the tags
-                tags = list()
-                # read until the end of the header
-                tag = ""
-                while bytes_read != new_ciff.header_size:
-                    c = ciff_file.read(1)
-                    if len(c) != 1:
-                        raise Exception("Invalid image: tags")
-                    bytes_read += 1
-                    char = c.decode('ascii')
-                    if char == '\n':
-                        raise Exception("Invalid image: tags")
-                    # tags are separated by terminating nulls
-                    tag += char
-                    if char == '\0':
-                        tags.append(tag)
-                        tag = ""
-                    # the very last character in the header must be a '\0'
-                    if bytes_read == new_ciff.header_size and char != '\0':
-                        raise Exception("Invalid image: tags")
-
-                
-                # all tags must end with '\0'
-                for tag in tags:
-                    if tag[-1] != '\0':
-                        raise Exception("Invalid image: tags")
-                new_ciff.tags = tags
-                
-                # read the pixels
-                while bytes_read < new_ciff.header_size+new_ciff.content_size:
-                    c = ciff_file.read(3)
-                    if len(c) != 3:
-                        raise Exception("Invalid image: content")
-                    bytes_read += 3
-                    pixel = struct.unpack("BBB", c)
-                    new_ciff.pixels.append(pixel)
-
-                # we should have reached the end of the file
-                of_byte = ciff_file.read(1)
-                if len(of_byte) != 0:
-                    raise Exception("Invalid image: content")
+                # the caption and the tags make up the rest of the header; the
+                # read never asks for more than the file holds, however large
+                # the header size claims to be
+                header = ciff_file.read(min(header_size, file_size) - _HEADER.size)
+
+            # the caption lasts until the first '\n' (caption cannot contain '\n')
+            caption_end = header.find(b"\n")
+            if caption_end == -1:
+                raise Exception("Invalid image: caption")
+            new_ciff.caption = header[:caption_end].decode('ascii')
+
+            # the tags fill the rest of the header, which must be complete
+            if len(header) != header_size - _HEADER.size:
+                raise Exception("Invalid image: tags")
+            # decoded all at once
+            tag_region = header[caption_end + 1:].decode('ascii')
+            # tags cannot contain '\n'
+            if "\n" in tag_region:
+                raise Exception("Invalid image: tags")
+            # the very last character in the header must be a '\0', which
+            # also makes every tag end with '\0' once split on the separators
+            if tag_region and not tag_region.endswith("\0"):
+                raise Exception("Invalid image: tags")
+            # tags are separated by terminating nulls
+            new_ciff.tags = [tag + '\0' for tag in tag_region.split("\0")[:-1]]
+
+            # the header and the pixels make up the whole file, so neither
+            # size can exceed what is actually on disk
+            if header_size + content_size != file_size:
+                raise Exception("Invalid image format: header size + content size not equal to file size")
+
+            # the pixels fill the rest of the file
+            new_ciff._pixel_source = (file_path, header_size)
 
         except Exception as e:
             new_ciff.is_valid = False
             new_ciff.error_message = str(e)
 
         return new_ciff
+
+    @staticmethod
+    def parse_ciff_files(file_paths, workers=None):
+        """
+        Parses several CIFF files concurrently
+
+        The threads only overlap the time spent waiting on the file system,
+        the header checks themselves hold the GIL; this pays off when the
+        files are not cached yet or live on a network file system, while for
+        cached local files a plain loop over parse_ciff_file is faster
+
+        :param file_paths: paths to the files to be parsed (iterable of strings)
+        :param workers: maximum number of threads (None for the default)
+        :return: list of the parsed CIFF objects, in the order of the paths
+        """
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(CIFF.parse_ciff_file, file_paths))
@@ -61,21 +61,23 @@ class Window(Frame):
 
         try:
             ciff_image = CIFF.parse_ciff_file(file_path)
+            # the pixels are loaded on first access, which can still
+            # invalidate the image
+            pixels = ciff_image.pixels
             if not ciff_image.is_valid:
                 raise ValueError(ciff_image.error_message)
                 # raise ValueError("Invalid CIFF image!")
 
-            self.display_image(ciff_image)
+            self.display_image(ciff_image, pixels)
             self.display_info(ciff_image)
 
         except Exception as e:
             messagebox.showerror("Error", f"Failed to load image:\n{e}")
 
-    def display_image(self, ciff_image):
+    def display_image(self, ciff_image, pixels):
         self.canvas.delete("all")
 
-        pil_image = Image.new("RGB", (ciff_image.width, ciff_image.height))
-        pil_image.putdata(ciff_image.pixels)
+        pil_image = Image.frombytes("RGB", (ciff_image.width, ciff_image.height), pixels)
         photo_image = ImageTk.PhotoImage(pil_image, master=self.canvas)
 
         self.canvas.create_image(0, 0, image=photo_image, anchor=NW)